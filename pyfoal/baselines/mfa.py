@@ -1,6 +1,7 @@
 import contextlib
 import logging
 import multiprocessing as mp
+import os
 import shutil
 import tempfile
 import warnings
@@ -70,12 +71,16 @@ def from_files_to_files(
         directory = Path(directory)
 
         # Copy files to temporary directory, preserving speaker
-        with mp.Pool(num_workers) as pool:
+        workers = os.cpu_count() if num_workers is None else num_workers
+        with mp.Pool(workers) as pool:
             iterator = zip(
                 [directory] * len(text_files),
                 text_files,
                 audio_files)
-            pool.starmap(copy_and_convert, iterator)
+            pool.starmap(
+                copy_and_convert,
+                iterator,
+                chunksize=max(1, len(text_files) // (workers * 4)))
 
         # MFA generates a lot of log information we don't need
         with disable_logging(logging.CRITICAL):
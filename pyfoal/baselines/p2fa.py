@@ -1,7 +1,6 @@
-import functools
+import itertools
 import multiprocessing as mp
 import os
-import string
 import subprocess
 import tempfile
 from pathlib import Path
@@ -19,6 +18,9 @@ import pyfoal
 ###############################################################################
 
 
+# Maximum number of utterances to align with one HVite call
+BATCH_SIZE = 256
+
 # The sampling rate that P2FA uses
 SAMPLE_RATE = 11025
 
@@ -30,18 +32,27 @@ SAMPLE_RATE = 11025
 
 def from_text_and_audio(text, audio, sample_rate=pyfoal.SAMPLE_RATE):
     """Align text and audio using P2FA"""
-    # Get duration in seconds at original sample rate
-    duration = audio.shape[-1] / sample_rate
+    return from_texts_and_audios([text], [audio], [sample_rate])[0]
+
+
+def from_texts_and_audios(texts, audios, sample_rates):
+    """Align many texts and audio using one P2FA call"""
+    # Get durations in seconds at original sample rate
+    durations = [
+        audio.shape[-1] / sample_rate
+        for audio, sample_rate in zip(audios, sample_rates)]
 
     # Maybe resample
-    audio = pyfoal.resample(audio, sample_rate, SAMPLE_RATE)
+    audios = [
+        pyfoal.resample(audio, sample_rate, SAMPLE_RATE)
+        for audio, sample_rate in zip(audios, sample_rates)]
 
     # Cache aligner
-    if not hasattr(from_text_and_audio, 'aligner'):
-        from_text_and_audio.aligner = Aligner()
+    if not hasattr(from_texts_and_audios, 'aligner'):
+        from_texts_and_audios.aligner = Aligner()
 
     # Align
-    return from_text_and_audio.aligner(text, audio, duration)
+    return from_texts_and_audios.aligner.batch(texts, audios, durations)
 
 
 def from_file(text_file, audio_file):
@@ -61,21 +72,61 @@ def from_file_to_file(text_file, audio_file, output_file):
     from_file(text_file, audio_file).save(output_file)
 
 
+def batch_from_files_to_files(text_files, audio_files, output_files):
+    """Align a batch of text and audio files on disk using P2FA and save"""
+    # Load text
+    texts = [pyfoal.load.text(text_file) for text_file in text_files]
+
+    # Load audio
+    audios, sample_rates = zip(*[
+        torchaudio.load(audio_file) for audio_file in audio_files])
+
+    # Align
+    alignments = from_texts_and_audios(texts, audios, sample_rates)
+
+    # Save
+    for alignment, output_file in zip(alignments, output_files):
+        alignment.save(output_file)
+
+
 def from_files_to_files(
     text_files,
     audio_files,
     output_files,
     num_workers=None):
     """Align many text and audio files on disk using P2FA and save"""
+    text_files, audio_files, output_files = \
+        list(text_files), list(audio_files), list(output_files)
+
     # Default to using all cpus
     if num_workers is None:
         num_workers = max(min(len(text_files) // 2, os.cpu_count() // 2), 1)
 
+    # Split files into batches so that each worker runs HVite once per batch
+    size = min(max(-(-len(text_files) // num_workers), 1), BATCH_SIZE)
+    iterator = [
+        (
+            text_files[i:i + size],
+            audio_files[i:i + size],
+            output_files[i:i + size]
+        )
+        for i in range(0, len(text_files), size)]
+
     # Launch multiprocessed P2FA alignment
-    align_fn = functools.partial(from_file_to_file)
-    iterator = zip(text_files, audio_files, output_files)
-    with mp.get_context('spawn').Pool(num_workers) as pool:
-        pool.starmap(align_fn, iterator)
+    with mp.get_context('spawn').Pool(
+        num_workers,
+        initializer=initialize_worker
+    ) as pool:
+        pool.starmap(
+            batch_from_files_to_files,
+            iterator,
+            chunksize=max(1, len(iterator) // (num_workers * 4)))
+
+
+def initialize_worker():
+    """Load the aligner and G2P model before a worker receives files"""
+    from_texts_and_audios.aligner = Aligner()
+    pyfoal.g2p.model()
 
 
 ###############################################################################
@@ -93,11 +144,12 @@ class Aligner:
         self.model = pyfoal.ASSETS_DIR / 'p2fa' / 'hmmdefs'
         self.monophones = pyfoal.ASSETS_DIR / 'p2fa' / 'monophones'
 
-        punctuation = [s for s in string.punctuation + '”“—' if s != '-']
-        self.punctuation_table = str.maketrans('-', ' ', ''.join(punctuation))
-
     def __call__(self, text, audio, duration):
         """Retrieve the forced alignment"""
+        return self.batch([text], [audio], [duration])[0]
+
+    def batch(self, texts, audios, durations):
+        """Retrieve the forced alignments of many utterances at once"""
         # Alignment artifacts are placed in temporary storage and cleaned-up
         # after alignment is complete
         with tempfile.TemporaryDirectory() as directory:
@@ -106,32 +158,63 @@ class Aligner:
             # HTK script path
             script_file = directory / 'test.scp'
 
-            # Preprocess
-            self.format(directory, audio, script_file)
+            # Start preprocessing in the background
+            process = self.format(directory, audios, script_file)
+
+            try:
+
+                # Grapheme-to-phoneme
+                texts, phonemes = pyfoal.g2p.from_texts(
+                    texts,
+                    to_indices=False,
+                    remove_prominence=False)
+
+                # Use P2FA silence token
+                phonemes = [
+                    [' ' if p == '<silent>' else p for p in item]
+                    for item in phonemes]
+
+                # Write HTK inputs
+                words = self.write_words(directory, texts)
+                dictionary = self.write_pronunciation(
+                    directory,
+                    texts,
+                    phonemes)
 
-            # Grapheme-to-phoneme
-            text, phonemes = pyfoal.g2p.from_text(
-                text,
-                to_indices=False,
-                remove_prominence=False)
+            except BaseException:
 
-            # Use P2FA silence token
-            for i in range(len(phonemes)):
-                if phonemes[i] == '<silent>':
-                    phonemes[i] = ' '
+                # Stop HCopy before its output directory is removed
+                process.kill()
+                process.wait()
+                raise
+
+            # Wait for preprocessing to finish
+            if process.wait():
+                raise subprocess.CalledProcessError(
+                    process.returncode,
+                    process.args)
 
             # Run alignment model
             alignment_file = directory / 'alignment.mlf'
-            self.viterbi(self.write_words(directory, text),
-                         self.write_pronunciation(directory, text, phonemes),
-                         directory,
-                         script_file,
-                         alignment_file)
+            self.viterbi(
+                words,
+                dictionary,
+                directory,
+                script_file,
+                alignment_file)
+
+            # Split alignments by utterance
+            alignment_files = self.split_alignment(
+                directory,
+                alignment_file,
+                len(texts))
 
             # Alignment rate and offset correction
-            alignment = self.correct_alignment(alignment_file, duration)
+            alignments = [
+                self.correct_alignment(file, duration)
+                for file, duration in zip(alignment_files, durations)]
 
-        return alignment
+        return alignments
 
     ###########################################################################
     # Utilities
@@ -143,72 +226,95 @@ class Aligner:
         alignment = pypar.Alignment(alignment_file)
 
         # Retrieve phoneme durations
-        durations = [p.duration() for p in alignment.phonemes()]
+        phonemes = alignment.phonemes()
+        durations = np.fromiter(
+            (p.duration() for p in phonemes),
+            dtype=np.float64,
+            count=len(phonemes))
 
         # Constant offset and rate correction
         # TODO - verify
         durations[0] += .0125
-        durations = [d * 11000. / 11025. for d in durations]
+        durations *= 11000. / 11025.
 
         # End at audio duration
-        durations[-1] = duration - sum(durations[:-1])
+        durations[-1] = duration - durations[:-1].sum()
 
         # Update alignment durations
-        alignment.update(durations=durations)
+        alignment.update(durations=durations.tolist())
 
         # Change silence token
-        for i in range(len(alignment)):
-            if str(alignment[i]) == 'sp':
-                alignment[i].word = pypar.SILENCE
-        for i in range(len(alignment.phonemes())):
-            if str(alignment.phonemes()[i]) == 'sp':
-                alignment.phonemes()[i].phoneme = pypar.SILENCE
+        for word in alignment:
+            if str(word) == 'sp':
+                word.word = pypar.SILENCE
+        for phoneme in phonemes:
+            if str(phoneme) == 'sp':
+                phoneme.phoneme = pypar.SILENCE
 
             # Remove prominence markings
-            alignment.phonemes()[i].phoneme = ''.join(
-                c for c in str(alignment.phonemes()[i]) if not c.isdigit())
+            phoneme.phoneme = str(phoneme).translate(pyfoal.g2p.PROMINENCE)
 
         return alignment
 
-    def format(self, directory, audio, script_file):
-        """Write HTK arguments and convert data to HTK format"""
-        # Save audio to disk
-        audiofile = directory / 'sound.wav'
-        soundfile.write(
-            str(audiofile),
-            audio.cpu().squeeze().numpy().astype(np.float32),
-            SAMPLE_RATE)
-
-        # Save HTK process metadata
+    def format(self, directory, audios, script_file):
+        """Write HTK arguments and start converting data to HTK format"""
         code_file = directory / 'codetr.scp'
-        plp_file = directory / 'tmp.plp'
-        with open(code_file, 'w') as file:
-            file.write(f'{audiofile} {plp_file}\n')
-        with open(script_file, 'w') as file:
-            file.write(f'{plp_file}\n')
+        with open(code_file, 'w') as code, open(script_file, 'w') as script:
+            for i, audio in enumerate(audios):
+
+                # Save audio to disk
+                audio_file = directory / f'{i}.wav'
+                soundfile.write(
+                    str(audio_file),
+                    audio.cpu().squeeze().numpy().astype(np.float32),
+                    SAMPLE_RATE)
+
+                # Save HTK process metadata
+                plp_file = directory / f'{i}.plp'
+                code.write(f'{audio_file} {plp_file}\n')
+                script.write(f'{plp_file}\n')
 
         # HTK preprocessing call
-        subprocess.Popen(
+        return subprocess.Popen(
             ['HCopy', '-T', '1', '-C', self.hcopy, '-S', code_file],
             stdout=subprocess.DEVNULL)
 
+    def split_alignment(self, directory, alignment_file, count):
+        """Split a multi-utterance alignment into one file per utterance"""
+        # Group lines by utterance
+        utterances, lines = {}, None
+        with open(alignment_file) as file:
+            for line in file:
+
+                # Start of utterance
+                if line.startswith('"'):
+                    stem = Path(line.strip().strip('"')).stem
+                    lines = utterances.setdefault(stem, [])
+
+                # End of utterance
+                elif line.strip() == '.':
+                    lines = None
+
+                elif lines is not None:
+                    lines.append(line)
+
+        # Write one alignment file per utterance
+        files = []
+        for i in range(count):
+            if str(i) not in utterances:
+                raise ValueError(f'HVite failed to align utterance {i}')
+            files.append(directory / f'{i}.mlf')
+            with open(files[-1], 'w') as file:
+                file.write('#!MLF!#\n')
+                file.writelines(utterances[str(i)])
+
+        return files
+
     def split_phonemes(self, phonemes):
         """Split phoneme list into words"""
-        word, words = [], []
-        for phoneme in phonemes:
-
-            # Add next phoneme
-            if phoneme == ' ' and word:
-                words.append(word)
-                word = []
-            else:
-                word.append(phoneme)
-
-        # Handle final word
-        if word:
-            words.append(word)
-
-        return words
+        return [
+            list(word) for is_space, word in
+            itertools.groupby(phonemes, ' '.__eq__) if not is_space]
 
     def viterbi(self, words, dictionary, directory, script_file, output):
         """Run viterbi decoding to align"""
@@ -225,35 +331,55 @@ class Aligner:
         with open(directory / 'aligned.results', 'w') as file:
             subprocess.Popen(args, stdout=file).wait()
 
-    def write_pronunciation(self, directory, text, phonemes):
+    def word_key(self, word, index):
+        """Dictionary key of a word in the utterance at the given index"""
+        return f'{word}_{index}'
+
+    def write_pronunciation(self, directory, texts, phonemes):
         """Write the pronunciation dictionary"""
-        # Convert to HTK dictionary format
-        iterator = zip(text.upper().split(), self.split_phonemes(phonemes))
-        lines = ['{}  {}\n'.format(w, ' '.join(p)) for w, p in iterator]
-        lines.append('sp  sp\n')
+        # Collect unique pronunciations of each utterance. Words are keyed by
+        # utterance so that HVite cannot pick a pronunciation that G2P chose
+        # for a different utterance (e.g., homographs).
+        entries = {('sp', ('sp',))}
+        for i, (text, item) in enumerate(zip(texts, phonemes)):
+            iterator = zip(text.upper().split(), self.split_phonemes(item))
+            entries.update(
+                (f'{self.word_key(word, i)} [{word}]', tuple(pron))
+                for word, pron in iterator)
+
+        # Sort by word and convert to HTK dictionary format
+        lines = ''.join(
+            f'{word}  {" ".join(pron)}\n' for word, pron in sorted(entries))
 
         # Write HTK dictionary
         filename = directory / 'dictionary'
         with open(filename, 'w') as file:
-            for line in sorted(lines):
-                file.write(line)
+            file.write(lines)
 
         return filename
 
-    def write_words(self, directory, text):
+    def write_words(self, directory, texts):
         """Write the mlf file containing the words to align"""
-        filename = directory / 'tmp.mlf'
-        with open(filename, 'w') as file:
+        # File header
+        lines = ['#!MLF!#\n']
+
+        for i, text in enumerate(texts):
+
+            # Utterance header
+            lines.append(f'"*/{i}.lab"\n')
 
-            # File header
-            file.write('#!MLF!#\n')
-            file.write('"*/tmp.lab"\n')
+            # Words with spaces in between
+            lines.append('sp\n')
+            lines.extend(
+                f'{self.word_key(word, i)}\nsp\n'
+                for word in text.upper().split())
 
-            # Write words with spaces in between
-            for word in text.upper().split():
-                file.write('sp\n')
-                file.write(f'{word}\n')
+            # Utterance footer
+            lines.append('.\n')
 
-            file.write('sp\n')
+        # Write HTK word labels
+        filename = directory / 'tmp.mlf'
+        with open(filename, 'w') as file:
+            file.write(''.join(lines))
 
         return filename
@@ -24,6 +24,10 @@ NUM_MELS = 80
 # Number of spectrogram channels
 NUM_FFT = 1024
 
+# The resampling method. One of ['soxr', 'torchaudio']. Using soxr requires
+# `pip install soxr`.
+RESAMPLER = 'torchaudio'
+
 # The audio sampling rate
 SAMPLE_RATE = 16000  # samples per second
 
@@ -46,6 +50,9 @@ DATASETS = ['arctic', 'libritts']
 # Datasets for evaluation
 EVALUATION_DATASETS = ['arctic']
 
+# Number of out-of-vocabulary words to convert to phonemes in one batch
+G2P_BATCH_SIZE = 256
+
 
 ###############################################################################
 # Decoder parameters
@@ -124,6 +131,10 @@ MAX_FRAMES = 65000
 # Number of steps between saving checkpoints
 CHECKPOINT_INTERVAL = 25000  # steps
 
+# Whether to compile the model with torch.compile when training on GPU.
+# Requires PyTorch 2.0 or later.
+COMPILE = False
+
 # Number of training steps
 STEPS = 250000
 
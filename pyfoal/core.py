@@ -2,6 +2,7 @@ import contextlib
 import functools
 import os
 
+import numpy as np
 import pypar
 import torch
 import torchaudio
@@ -368,6 +369,26 @@ def resample(audio, sample_rate, target_rate=pyfoal.SAMPLE_RATE):
     """Perform audio resampling"""
     if sample_rate == target_rate:
         return audio
-    resampler = torchaudio.transforms.Resample(sample_rate, target_rate)
-    resampler = resampler.to(audio.device)
-    return resampler(audio)
+
+    # Vectorized CPU resampling via libsoxr
+    if pyfoal.RESAMPLER == 'soxr':
+        import soxr
+        resampled = soxr.resample(
+            np.ascontiguousarray(audio.cpu().numpy().T),
+            sample_rate,
+            target_rate,
+            quality='HQ')
+        return torch.from_numpy(resampled.T.copy()).to(audio)
+
+    if pyfoal.RESAMPLER != 'torchaudio':
+        raise ValueError(f'Resampler {pyfoal.RESAMPLER} is not defined')
+
+    # Cache resampling kernels
+    if not hasattr(resample, 'resamplers'):
+        resample.resamplers = {}
+    key = (sample_rate, target_rate, audio.device)
+    if key not in resample.resamplers:
+        resampler = torchaudio.transforms.Resample(sample_rate, target_rate)
+        resample.resamplers[key] = resampler.to(audio.device)
+
+    return resample.resamplers[key](audio)
@@ -16,10 +16,17 @@ def loader(dataset, partition=None, gpu=None):
     # Get sampler
     sampler = pyfoal.data.sampler(dataset, partition)
 
+    # Keep training workers alive across epochs and let them prefetch further
+    # ahead. Evaluation loaders are only read briefly between long gaps.
+    kwargs = {}
+    if partition == 'train' and pyfoal.NUM_WORKERS > 0:
+        kwargs = {'persistent_workers': True, 'prefetch_factor': 4}
+
     # Create loader
     return torch.utils.data.DataLoader(
         dataset,
         num_workers=pyfoal.NUM_WORKERS,
         pin_memory=gpu is not None,
         collate_fn=pyfoal.data.collate,
-        batch_sampler=sampler)
+        batch_sampler=sampler,
+        **kwargs)
@@ -16,6 +16,10 @@ def parse_args():
         default=pyfoal.DATASETS,
         nargs='+',
         help='The names of the datasets to preprocess')
+    parser.add_argument(
+        '--gpu',
+        type=int,
+        help='The index of the GPU to use for preprocessing. Defaults to CPU.')
     return parser.parse_args()
 
 
@@ -10,11 +10,13 @@ import pyfoal
 ###############################################################################
 
 
-def datasets(datasets):
+def datasets(datasets, gpu=None):
     """Preprocess a dataset
     Arguments
         name - string
             The name of the dataset to preprocess
+        gpu - int
+            The index of the gpu to use for grapheme-to-phoneme conversion
     """
     for dataset in datasets:
         directory = pyfoal.CACHE_DIR / dataset
@@ -30,7 +32,7 @@ def datasets(datasets):
             file.parent / f'{file.stem}-phonemes.pt' for file in text_files]
 
         # Grapheme-to-phoneme
-        pyfoal.g2p.from_files_to_files(text_files, phoneme_files)
+        pyfoal.g2p.from_files_to_files(text_files, phoneme_files, gpu)
 
         # Get output prior files
         prior_files = [
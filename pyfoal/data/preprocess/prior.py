@@ -46,7 +46,9 @@ def from_file_to_file(text_file, audio_file, output_file):
 
 def from_files_to_files(text_files, audio_files, output_files):
     """Compute attention priors from files and save"""
-    with multiprocessing.Pool(os.cpu_count() // 2) as pool:
+    workers = os.cpu_count() // 2
+    with multiprocessing.Pool(workers) as pool:
         pool.starmap(
             from_file_to_file,
-            zip(text_files, audio_files, output_files))
\ No newline at end of file
+            zip(text_files, audio_files, output_files),
+            chunksize=max(1, len(text_files) // (workers * 4)))
\ No newline at end of file
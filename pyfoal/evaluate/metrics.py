@@ -32,9 +32,10 @@ class Metrics:
         logits=None,
         phoneme_lengths=None,
         frame_lengths=None):
-        # Update phoneme duration accuracy and error
-        self.accuracy.update(alignments, targets)
-        self.l1.update(alignments, targets)
+        # Maybe update phoneme duration accuracy and error
+        if alignments is not None and targets is not None:
+            self.accuracy.update(alignments, targets)
+            self.l1.update(alignments, targets)
 
         # Update loss
         if logits is not None:
@@ -130,8 +131,13 @@ class Loss:
         return {'loss': (self.total / self.count).item()}
 
     def update(self, logits, phoneme_lengths, frame_lengths):
-        self.total += pyfoal.train.loss(logits, phoneme_lengths, frame_lengths)
-        self.count += logits.shape[0]
+        self.add(
+            pyfoal.train.loss(logits, phoneme_lengths, frame_lengths),
+            logits.shape[0])
+
+    def add(self, loss, count):
+        self.total += loss
+        self.count += count
 
     def reset(self):
         self.count = 0
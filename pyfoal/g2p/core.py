@@ -1,6 +1,9 @@
+import itertools
 import multiprocessing
 import os
+import re
 import string
+import unicodedata
 
 import g2p_en
 import torch
@@ -8,6 +11,28 @@ import torch
 import pyfoal
 
 
+###############################################################################
+# Constants
+###############################################################################
+
+
+# Translation table that removes prominence markings from phonemes
+PROMINENCE = str.maketrans('', '', string.digits)
+
+# Translation table that removes punctuation and splits hyphenated words
+PUNCTUATION = str.maketrans(
+    '-',
+    ' ',
+    ''.join(s for s in string.punctuation + '”“—' if s != '-'))
+
+# Runs of whitespace, including newlines and tabs
+WHITESPACE = re.compile(r'\s+')
+
+# Maximum number of phonemes predicted for an out-of-vocabulary word,
+# including the end token
+MAX_DECODER_STEPS = 20
+
+
 ###############################################################################
 # Grapheme-to-phoneme (G2P)
 ###############################################################################
@@ -15,43 +40,24 @@ import pyfoal
 
 def from_text(text, to_indices=True, remove_prominence=True):
     """Convert text to cmu"""
-    # Remove newlines, tabs, and extra whitespace
-    text = text.replace('\n', ' ')
-    text = text.replace('\t', ' ')
-    while '  ' in text:
-        text = text.replace('  ', ' ')
-
-    # Convert numbers to text
-    text = g2p_en.expand.normalize_numbers(text)
+    texts, phonemes = from_texts([text], to_indices, remove_prominence)
+    return texts[0], phonemes[0]
 
-    # Remove punctuation
-    punctuation = [s for s in string.punctuation + '”“—' if s != '-']
-    text = text.translate(str.maketrans('-', ' ', ''.join(punctuation)))
 
-    # Grapheme-to-phoneme conversion
-    phonemes = g2p_en.G2p()(text)
+def from_texts(texts, to_indices=True, remove_prominence=True, gpu=None):
+    """Convert many texts to cmu, predicting unknown words in batches"""
+    # Clean text
+    texts = [preprocess(text) for text in texts]
 
-    # Remove prominence markings
-    if remove_prominence:
-        phonemes = [
-            ''.join(c for c in phoneme if not c.isdigit())
-            for phoneme in phonemes]
+    # Look up known pronunciations
+    pronunciations = [lookup(text) for text in texts]
 
-    # Handle silences
+    # Predict pronunciations of out-of-vocabulary words across all texts
     phonemes = [
-        '<silent>' if phoneme == ' ' else phoneme for phoneme in phonemes]
+        postprocess(item, to_indices, remove_prominence)
+        for item in complete(pronunciations, gpu)]
 
-    # Ensure start and end have silent tokens
-    if phonemes[0] != '<silent>':
-        phonemes.insert(0, '<silent>')
-    if phonemes[-1] != '<silent>':
-        phonemes.append('<silent>')
-
-    # Maybe convert to indices
-    if to_indices:
-        indices = pyfoal.convert.phonemes_to_indices(phonemes)
-        return text, torch.tensor(indices, dtype=torch.long)
-    return text, phonemes
+    return texts, phonemes
 
 
 def from_file(text_file):
@@ -64,7 +70,258 @@ def from_file_to_file(text_file, output_file):
     torch.save(from_file(text_file), output_file)
 
 
-def from_files_to_files(text_files, output_files):
+def from_files_to_files(text_files, output_files, gpu=None):
     """Convert text on disk to phonemes and save"""
-    with multiprocessing.Pool(os.cpu_count() // 2) as pool:
-        pool.starmap(from_file_to_file, zip(text_files, output_files))
+    text_files, output_files = list(text_files), list(output_files)
+
+    # Load pronunciation dictionaries once so forked workers share them
+    model()
+
+    workers = max(os.cpu_count() // 2, 1)
+    chunksize = max(1, len(text_files) // (workers * 4))
+    with multiprocessing.Pool(workers, initializer=model) as pool:
+
+        # Load text and look up known pronunciations in parallel
+        pronunciations = pool.map(lookup_file, text_files, chunksize)
+
+        # Predict out-of-vocabulary words in batches in this process
+        phonemes = complete(pronunciations, gpu)
+
+        # Convert to indices and save in parallel
+        pool.starmap(
+            postprocess_to_file,
+            zip(phonemes, output_files),
+            chunksize)
+
+
+###############################################################################
+# Batched g2p_en model
+###############################################################################
+
+
+class G2p(torch.nn.Module):
+    """Batched port of the g2p_en out-of-vocabulary model"""
+
+    def __init__(self):
+        super().__init__()
+        g2p = g2p_en.G2p()
+
+        # Pronunciation dictionaries
+        self.cmu = g2p.cmu
+        self.homographs = g2p.homograph2features
+        self.grapheme_to_index = g2p.g2idx
+        self.index_to_phoneme = g2p.idx2p
+
+        # Decoder start and end tokens
+        self.start_index = g2p.p2idx['<s>']
+        self.end_index = g2p.p2idx['</s>']
+
+        # Encoder
+        embedding_size = g2p.enc_emb.shape[1]
+        hidden_size = g2p.enc_w_hh.shape[1]
+        self.encoder_embedding = torch.nn.Embedding.from_pretrained(
+            torch.from_numpy(g2p.enc_emb).float())
+        self.encoder = torch.nn.GRU(
+            embedding_size,
+            hidden_size,
+            batch_first=True)
+        self.encoder.load_state_dict({
+            'weight_ih_l0': torch.from_numpy(g2p.enc_w_ih),
+            'weight_hh_l0': torch.from_numpy(g2p.enc_w_hh),
+            'bias_ih_l0': torch.from_numpy(g2p.enc_b_ih),
+            'bias_hh_l0': torch.from_numpy(g2p.enc_b_hh)})
+
+        # Decoder
+        self.decoder_embedding = torch.nn.Embedding.from_pretrained(
+            torch.from_numpy(g2p.dec_emb).float())
+        self.decoder = torch.nn.GRUCell(embedding_size, hidden_size)
+        self.decoder.load_state_dict({
+            'weight_ih': torch.from_numpy(g2p.dec_w_ih),
+            'weight_hh': torch.from_numpy(g2p.dec_w_hh),
+            'bias_ih': torch.from_numpy(g2p.dec_b_ih),
+            'bias_hh': torch.from_numpy(g2p.dec_b_hh)})
+        self.projection = torch.nn.Linear(hidden_size, g2p.fc_w.shape[0])
+        self.projection.load_state_dict({
+            'weight': torch.from_numpy(g2p.fc_w),
+            'bias': torch.from_numpy(g2p.fc_b)})
+
+    @torch.no_grad()
+    def forward(self, words):
+        """Predict phoneme indices of a batch of words"""
+        device = self.projection.weight.device
+
+        # Encode graphemes followed by an end token
+        unknown = self.grapheme_to_index['<unk>']
+        indices = [
+            torch.tensor(
+                [self.grapheme_to_index.get(c, unknown) for c in word] +
+                [self.grapheme_to_index['</s>']])
+            for word in words]
+        lengths = torch.tensor([len(index) for index in indices])
+        embeddings = self.encoder_embedding(
+            torch.nn.utils.rnn.pad_sequence(indices, True).to(device))
+        _, hidden = self.encoder(torch.nn.utils.rnn.pack_padded_sequence(
+            embeddings,
+            lengths,
+            batch_first=True,
+            enforce_sorted=False))
+        hidden = hidden[0]
+
+        # Greedy decoding from the start token
+        tokens = torch.full(
+            (len(words),),
+            self.start_index,
+            dtype=torch.long,
+            device=device)
+        done = torch.zeros(len(words), dtype=torch.bool, device=device)
+        predictions = []
+        for _ in range(MAX_DECODER_STEPS):
+            hidden = self.decoder(self.decoder_embedding(tokens), hidden)
+            tokens = self.projection(hidden).argmax(dim=1)
+            predictions.append(tokens)
+
+            # Stop when every word has produced an end token
+            done |= tokens == self.end_index
+            if done.all():
+                break
+
+        return torch.stack(predictions, dim=1)
+
+    def predict(self, words):
+        """Predict pronunciations of out-of-vocabulary words"""
+        pronunciations = []
+
+        # Batch words of similar length to minimize padding
+        ordered = sorted(words, key=len)
+        for i in range(0, len(ordered), pyfoal.G2P_BATCH_SIZE):
+            batch = ordered[i:i + pyfoal.G2P_BATCH_SIZE]
+            for indices in self(batch).tolist():
+
+                # Truncate at end token
+                if self.end_index in indices:
+                    indices = indices[:indices.index(self.end_index)]
+
+                pronunciations.append([
+                    self.index_to_phoneme.get(index, '<unk>')
+                    for index in indices])
+
+        # Restore original order
+        by_word = dict(zip(ordered, pronunciations))
+        return [by_word[word] for word in words]
+
+
+###############################################################################
+# Utilities
+###############################################################################
+
+
+def complete(pronunciations, gpu=None):
+    """Predict out-of-vocabulary words in batches and join words"""
+    # Get inference device
+    device = torch.device('cpu' if gpu is None else f'cuda:{gpu}')
+
+    # Predict each unique out-of-vocabulary word once
+    words = sorted({
+        word for pronunciation in pronunciations
+        for word in pronunciation if isinstance(word, str)})
+    predictions = dict(zip(words, model().to(device).predict(words)))
+
+    # Join words with spaces in between
+    phonemes = []
+    for pronunciation in pronunciations:
+        item = []
+        for word in pronunciation:
+            item.extend(predictions[word] if isinstance(word, str) else word)
+            item.append(' ')
+        phonemes.append(item[:-1])
+
+    return phonemes
+
+
+def lookup(text):
+    """Retrieve known pronunciations, leaving out-of-vocabulary words as-is"""
+    g2p = model()
+
+    # Same normalization as g2p_en
+    text = g2p_en.expand.normalize_numbers(text)
+    text = ''.join(
+        char for char in unicodedata.normalize('NFD', text)
+        if unicodedata.category(char) != 'Mn')
+    text = re.sub(r"[^ a-z'.,?!\-]", '', text.lower())
+    text = text.replace('i.e.', 'that is')
+    text = text.replace('e.g.', 'for example')
+
+    # Tokenize and tag parts of speech
+    tokens = g2p_en.g2p.pos_tag(g2p_en.g2p.word_tokenize(text))
+
+    pronunciations = []
+    for word, pos in tokens:
+
+        # Punctuation
+        if re.search('[a-z]', word) is None:
+            pronunciations.append([word])
+
+        # Homographs
+        elif word in g2p.homographs:
+            pronunciation, alternate, homograph_pos = g2p.homographs[word]
+            pronunciations.append(
+                pronunciation if pos.startswith(homograph_pos) else alternate)
+
+        # CMU dictionary
+        elif word in g2p.cmu:
+            pronunciations.append(g2p.cmu[word][0])
+
+        # Out-of-vocabulary
+        else:
+            pronunciations.append(word)
+
+    return pronunciations
+
+
+def model():
+    """Load the G2P model"""
+    # Cache model
+    if not hasattr(model, 'model'):
+        model.model = G2p()
+    return model.model
+
+
+def postprocess(phonemes, to_indices=True, remove_prominence=True):
+    """Format phonemes produced by g2p_en"""
+    # Ensure start and end have silent tokens
+    start = [] if phonemes[0] == ' ' else [' ']
+    end = [] if phonemes[-1] == ' ' else [' ']
+
+    # Handle silences and maybe remove prominence markings
+    table = PROMINENCE if remove_prominence else {}
+    phonemes = [
+        '<silent>' if phoneme == ' ' else phoneme.translate(table)
+        for phoneme in itertools.chain(start, phonemes, end)]
+
+    # Maybe convert to indices
+    if to_indices:
+        indices = pyfoal.convert.phonemes_to_indices(phonemes)
+        return torch.tensor(indices, dtype=torch.long)
+    return phonemes
+
+
+def lookup_file(text_file):
+    """Load and clean text on disk and look up known pronunciations"""
+    return lookup(preprocess(pyfoal.load.text(text_file)))
+
+
+def postprocess_to_file(phonemes, output_file):
+    """Format phonemes produced by g2p_en and save"""
+    torch.save(postprocess(phonemes), output_file)
+
+
+def preprocess(text):
+    """Clean text prior to grapheme-to-phoneme conversion"""
+    # Remove newlines, tabs, and extra whitespace
+    text = WHITESPACE.sub(' ', text).strip()
+
+    # Convert numbers to text
+    text = g2p_en.expand.normalize_numbers(text)
+
+    # Remove punctuation
+    return text.translate(PUNCTUATION)
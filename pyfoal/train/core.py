@@ -87,7 +87,12 @@ def train(
     # Create optimizer #
     ####################
 
-    optimizer = torch.optim.Adam(model.parameters())
+    # Update all parameters with one fused kernel on GPU, or multi-tensor
+    # operations on CPU
+    optimizer = torch.optim.Adam(
+        model.parameters(),
+        foreach=device.type != 'cuda',
+        fused=device.type == 'cuda')
 
     ##############################
     # Maybe load from checkpoint #
@@ -100,6 +105,22 @@ def train(
         # Load model
         model, optimizer, step = pyfoal.checkpoint.load(path, model, optimizer)
 
+        # Loading restores the optimizer flags saved in the checkpoint
+        for group in optimizer.param_groups:
+            group['foreach'] = device.type != 'cuda'
+            group['fused'] = device.type == 'cuda'
+
+            # The fused kernel expects step counts on the parameter device,
+            # but checkpoints from unfused runs leave them on the CPU
+            if group['fused']:
+                for parameter in group['params']:
+                    state = optimizer.state[parameter]
+                    if 'step' in state:
+                        state['step'] = torch.as_tensor(
+                            state['step'],
+                            dtype=torch.float32,
+                            device=parameter.device)
+
     else:
 
         # Train from scratch
@@ -114,12 +135,31 @@ def train(
             model,
             device_ids=[rank])
 
+    ###########################
+    # Maybe compile the model #
+    ###########################
+
+    # Checkpointing and evaluation use the uncompiled model
+    if pyfoal.COMPILE and device.type == 'cuda':
+        forward = torch.compile(model)
+    else:
+        forward = model
+
     #########
     # Train #
     #########
 
-    # Automatic mixed precision (amp) gradient scaler
-    scaler = torch.cuda.amp.GradScaler()
+    # Automatic mixed precision (amp) on GPU. Bfloat16 has the range of
+    # float32 and does not need a gradient scaler.
+    if device.type == 'cuda' and torch.cuda.is_bf16_supported():
+        amp_dtype, scaler = torch.bfloat16, None
+    elif device.type == 'cuda':
+        amp_dtype, scaler = torch.float16, torch.cuda.amp.GradScaler()
+    else:
+        amp_dtype, scaler = None, None
+
+    # Training metrics are accumulated from the training forward pass
+    train_metrics = pyfoal.evaluate.Metrics()
 
     # Setup progress bar
     if not rank:
@@ -140,21 +180,28 @@ def train(
 
             # Unpack batch
             phonemes, audio, priors, mask, phoneme_lengths, frame_lengths, *_ = batch
+            phoneme_lengths = phoneme_lengths.to(device, non_blocking=True)
+            frame_lengths = frame_lengths.to(device, non_blocking=True)
 
-            with torch.autocast(device.type):
+            with torch.autocast(
+                device.type,
+                dtype=amp_dtype,
+                enabled=amp_dtype is not None
+            ):
 
                 # Forward pass
-                logits = model(
-                    phonemes.to(device),
-                    audio.to(device),
-                    priors.to(device),
-                    mask.to(device))
+                logits = forward(
+                    phonemes.to(device, non_blocking=True),
+                    audio.to(device, non_blocking=True),
+                    priors.to(device, non_blocking=True),
+                    mask.to(device, non_blocking=True))
 
                 # Compute loss
-                losses = loss(
-                    logits,
-                    phoneme_lengths.to(device),
-                    frame_lengths.to(device))
+                losses = loss(logits, phoneme_lengths, frame_lengths)
+
+                # Update training loss without recomputing it
+                if not rank:
+                    train_metrics.loss.add(losses.detach(), logits.shape[0])
 
             ######################
             # Optimize model #
@@ -162,14 +209,24 @@ def train(
 
             optimizer.zero_grad()
 
-            # Backward pass
-            scaler.scale(losses).backward()
+            if scaler is None:
+
+                # Backward pass
+                losses.backward()
 
-            # Update weights
-            scaler.step(optimizer)
+                # Update weights
+                optimizer.step()
+
+            else:
 
-            # Update gradient scaler
-            scaler.update()
+                # Backward pass
+                scaler.scale(losses).backward()
+
+                # Update weights
+                scaler.step(optimizer)
+
+                # Update gradient scaler
+                scaler.update()
 
             ###########
             # Logging #
@@ -182,13 +239,20 @@ def train(
                 ############
 
                 if step % pyfoal.LOG_INTERVAL == 0:
+
+                    # Write training metrics since the last evaluation
+                    scalars = {
+                        f'{key}/train': value
+                        for key, value in train_metrics().items()}
+                    pyfoal.write.scalars(log_directory, step, scalars)
+                    train_metrics.reset()
+
                     evaluate_fn = functools.partial(
                         evaluate,
                         log_directory,
                         step,
                         model,
                         gpu)
-                    evaluate_fn('train', train_loader)
                     evaluate_fn('valid', valid_loader)
                     evaluate_fn('test', test_loader)
 
@@ -259,10 +323,10 @@ def evaluate(directory, step, model, gpu, condition, loader):
 
             # Forward pass
             logits = model(
-                phonemes.to(device),
-                audios.to(device),
-                priors.to(device),
-                mask.to(device)).detach()
+                phonemes.to(device, non_blocking=True),
+                audios.to(device, non_blocking=True),
+                priors.to(device, non_blocking=True),
+                mask.to(device, non_blocking=True)).detach()
 
             if condition == 'test':
 
@@ -318,8 +382,8 @@ def evaluate(directory, step, model, gpu, condition, loader):
                 alignments,
                 targets,
                 logits,
-                phoneme_lengths.to(device),
-                frame_lengths.to(device))
+                phoneme_lengths.to(device, non_blocking=True),
+                frame_lengths.to(device, non_blocking=True))
 
             # Stop when we exceed some number of batches
             if i + 1 == pyfoal.LOG_STEPS:
@@ -388,26 +452,51 @@ def ddp_context(rank, world_size):
 def loss(logits, phoneme_lengths, frame_lengths):
     # Pad logits
     logits = torch.nn.functional.pad(logits, (1, 0), value=-1)
-
-    total = 0.
-    iterator = zip(logits, phoneme_lengths, frame_lengths)
-    for logit, phoneme_length, frame_length in iterator:
-
-        # Make ground truth targets
-        target_seq = torch.arange(1, phoneme_length + 1).unsqueeze(0)
-
-        # Compute log probabilities
-        log_prob = torch.nn.functional.log_softmax(
-            logit[:frame_length, :phoneme_length + 1],
-            dim=1)
-
-        # Compute CTC loss
-        total += torch.nn.functional.ctc_loss(
-            log_prob,
-            target_seq,
-            input_lengths=frame_length[None],
-            target_lengths=phoneme_length[None],
-            zero_infinity=True)
-
-    # Average
-    return total / logits.shape[0]
+    batch, frames, classes = logits.shape
+    device = logits.device
+
+    # Exclude phonemes beyond the end of each sequence. A large finite value
+    # is used because ctc_loss gradients are undefined at -inf.
+    logits = logits.masked_fill(
+        torch.arange(classes, device=device)[None, None] >
+        phoneme_lengths[:, None, None],
+        -1e4)
+
+    # Zero frames beyond the end of each sequence to keep gradients finite
+    logits = logits.masked_fill(
+        torch.arange(frames, device=device)[None, :, None] >=
+        frame_lengths[:, None, None],
+        0.)
+
+    # Compute log probabilities
+    log_probs = torch.nn.functional.log_softmax(logits, dim=2)
+
+    # Make ground truth targets
+    targets = ctc_targets(classes - 1, device).expand(batch, -1)
+
+    # Compute CTC loss averaged over the batch
+    return torch.nn.functional.ctc_loss(
+        log_probs.transpose(0, 1),
+        targets,
+        input_lengths=frame_lengths,
+        target_lengths=phoneme_lengths,
+        zero_infinity=True)
+
+
+def ctc_targets(length, device):
+    """Retrieve the phoneme indices 1, ..., length on a device"""
+    # Cache targets per device
+    if not hasattr(ctc_targets, 'cache'):
+        ctc_targets.cache = {}
+
+    # Maybe extend cache
+    if (
+        device not in ctc_targets.cache or
+        len(ctc_targets.cache[device]) < length
+    ):
+        ctc_targets.cache[device] = torch.arange(
+            1,
+            length + 1,
+            device=device)
+
+    return ctc_targets.cache[device][:length]